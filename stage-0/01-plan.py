@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+from manifest import VIDEO_STAGES, CATALOG_STAGES, load_manifest, artifact_status, video_artifacts, catalog_artifacts
+
+def log(action, data):
+    print(json.dumps({"action": action, "data": data}, ensure_ascii=False), flush=True)
+
+def plan_stages(stages, specs, manifest, base_dir, include_untracked, upstream_changed=False):
+    planned = []
+    untracked = []
+    for stage in stages:
+        status = artifact_status(manifest, stage, base_dir, specs[stage])
+        if status == "untracked":
+            untracked.append(stage)
+        if upstream_changed:
+            reason = "upstream"
+        elif status in ["missing", "config", "input", "output"] or (status == "untracked" and include_untracked):
+            reason = status
+        else:
+            continue
+        planned.append({"stage": stage, "script": specs[stage]["script"], "reason": reason})
+        upstream_changed = True
+    return planned, untracked
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    include_untracked = "--include-untracked" in sys.argv
+    data_root = os.path.join("..", "data")
+    if not os.path.isdir(data_root):
+        log("error", {"code": 1, "msg": f"Pasta de dados não encontrada: {data_root}"})
+        sys.exit(1)
+    video_ids = args or sorted(
+        name for name in os.listdir(data_root)
+        if os.path.isfile(os.path.join(data_root, name, "info.json"))
+    )
+    log("start", {"script": "01-plan", "videos": len(video_ids)})
+
+    specs = video_artifacts()
+    plan = {}
+    untracked = {}
+    commands = []
+    catalog_changed = False
+    for video_id in video_ids:
+        base_dir = os.path.join(data_root, video_id)
+        try:
+            manifest = load_manifest(base_dir)
+            planned, video_untracked = plan_stages(VIDEO_STAGES, specs, manifest, base_dir, include_untracked)
+        except Exception as e:
+            log("error", {"msg": f"Falha ao avaliar o manifesto do vídeo {video_id}", "error": str(e)})
+            continue
+        if video_untracked:
+            untracked[video_id] = video_untracked
+        if planned:
+            plan[video_id] = planned
+            # A transcrição, a sinopse e os embeddings alimentam as etapas do catálogo
+            catalog_changed = catalog_changed or any(p["stage"] != "video" for p in planned)
+            for p in planned:
+                stage_dir, script = p["script"].split("/")
+                commands.append(f"cd {stage_dir} && python {script} {video_id}")
+
+    catalog_specs = catalog_artifacts(data_root)
+    catalog_manifest = load_manifest(data_root)
+    # A deduplicação é opcional: só entra no plano se já tiver sido executada alguma vez
+    catalog_stages = [s for s in CATALOG_STAGES if s != "dedup" or os.path.exists(os.path.join(data_root, "dedup.json"))]
+    catalog_plan, catalog_untracked = plan_stages(catalog_stages, catalog_specs, catalog_manifest, data_root, include_untracked, catalog_changed)
+    if catalog_untracked:
+        untracked["catalog"] = catalog_untracked
+    for p in catalog_plan:
+        stage_dir, script = p["script"].split("/")
+        commands.append(f"cd {stage_dir} && python {script}")
+
+    summary = {stage: sum(1 for planned in plan.values() for p in planned if p["stage"] == stage) for stage in VIDEO_STAGES}
+    summary.update({p["stage"]: 1 for p in catalog_plan})
+    log("plan", {"videos": plan, "catalog": catalog_plan, "untracked": untracked, "summary": summary, "commands": commands})
+    log("done", f"{len(commands)} execuções planejadas para {len(plan)} de {len(video_ids)} vídeos.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import glob
+import time
+import hashlib
+
+# Ordem das etapas por vídeo; cada uma depende da anterior
+VIDEO_STAGES = ["video", "transcription", "synopsis", "embeddings"]
+CATALOG_STAGES = ["dedup", "global_index"]
+TRANSCRIPTION_SCRIPTS = {
+    "faster-whisper": "stage-1/02-transcribe-fast.py",
+    "whisper": "stage-1/02-transcribe.py",
+}
+
+def manifest_path(base_dir):
+    return os.path.join(base_dir, "manifest.json")
+
+def load_manifest(base_dir):
+    manifest_file = manifest_path(base_dir)
+    if not os.path.exists(manifest_file):
+        return {"artifacts": {}}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def file_fingerprint(path, previous=None):
+    stat = os.stat(path)
+    # Evita recalcular o hash de arquivos grandes (ex.: video.mp4) que não mudaram
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return {"sha256": sha256.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def outputs_newer_than_inputs(base_dir, spec):
+    input_paths = [os.path.join(base_dir, n) for n in spec["inputs"] if os.path.exists(os.path.join(base_dir, n))]
+    if not input_paths:
+        return True
+    oldest_output = min(os.stat(os.path.join(base_dir, n)).st_mtime_ns for n in spec["outputs"])
+    return oldest_output >= max(os.stat(p).st_mtime_ns for p in input_paths)
+
+def artifact_status(manifest, name, base_dir, spec):
+    entry = manifest["artifacts"].get(name)
+    for output in spec["outputs"]:
+        # Saídas que a etapa não gerou (ex.: transcrição sem segmentos) não entram no manifesto
+        if not os.path.exists(os.path.join(base_dir, output)) and (entry is None or output in entry.get("outputs", {})):
+            return "missing"
+    if entry is None:
+        # Saídas antigas só podem ser adotadas se forem mais novas que as entradas
+        return "untracked" if outputs_newer_than_inputs(base_dir, spec) else "input"
+    if entry.get("model") != spec["model"] or entry.get("params") != spec["params"]:
+        return "config"
+    recorded_inputs = entry.get("inputs", {})
+    if set(recorded_inputs) != set(spec["inputs"]):
+        return "input"
+    for input_name in spec["inputs"]:
+        input_path = os.path.join(base_dir, input_name)
+        if not os.path.exists(input_path):
+            return "input"
+        if file_fingerprint(input_path, recorded_inputs[input_name])["sha256"] != recorded_inputs[input_name]["sha256"]:
+            return "input"
+    for output_name, recorded in entry.get("outputs", {}).items():
+        if file_fingerprint(os.path.join(base_dir, output_name), recorded)["sha256"] != recorded["sha256"]:
+            return "output"
+    return "current"
+
+def record_artifact(name, base_dir, spec):
+    manifest = load_manifest(base_dir)
+    previous = manifest["artifacts"].get(name, {})
+    fingerprint = lambda n, recorded: file_fingerprint(os.path.join(base_dir, n), recorded.get(n))
+    manifest["artifacts"][name] = {
+        "inputs": {n: fingerprint(n, previous.get("inputs", {})) for n in spec["inputs"]},
+        "outputs": {n: fingerprint(n, previous.get("outputs", {})) for n in spec["outputs"] if os.path.exists(os.path.join(base_dir, n))},
+        "model": spec["model"],
+        "params": spec["params"],
+        "timestamp": int(time.time())
+    }
+    with open(manifest_path(base_dir), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+def video_artifacts(transcription_engine=None):
+    # Cada script de transcrição informa o próprio motor; o planejador usa o configurado
+    engine = transcription_engine or os.environ.get("TRANSCRIPTION_ENGINE", "faster-whisper")
+    return {
+        "video": {
+            "script": "stage-1/01-video-download.py",
+            "inputs": [],
+            "outputs": ["video.mp4", "info.json"],
+            "model": None,
+            "params": {"format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"}
+        },
+        "transcription": {
+            "script": TRANSCRIPTION_SCRIPTS[engine],
+            "inputs": ["video.mp4"],
+            "outputs": ["transcription.json"],
+            "model": os.environ.get("TRANSCRIPTION_WHISPER_MODEL", "base"),
+            "params": {"engine": engine}
+        },
+        "synopsis": {
+            "script": "stage-1/03-synopsis.py",
+            "inputs": ["transcription.json"],
+            "outputs": ["synopsis.txt"],
+            "model": "{}/{}@{}".format(
+                os.environ.get("SINOPSIS_HUGGINGFACE_REPO_ID"),
+                os.environ.get("SINOPSIS_HUGGINGFACE_FILE"),
+                os.environ.get("SINOPSIS_HUGGINGFACE_REVISION", "main")
+            ),
+            "params": {
+                "context_window": int(os.environ.get("SINOPSIS_LLAMA_CONTEXT_WINDOW", 8192)),
+                "chunk_size": int(os.environ.get("SINOPSIS_CHUNK_SIZE_TOKENS", 7000)),
+                "temperature": float(os.environ.get("SINOPSIS_LLAMA_TEMPERATURE", 0.7)),
+                "top_p": float(os.environ.get("SINOPSIS_LLAMA_TOP_P", 0.9)),
+            }
+        },
+        "embeddings": {
+            "script": "stage-2/01-faiss-index-segments.py",
+            "inputs": ["synopsis.txt", "transcription.json"],
+            "outputs": [
+                os.path.join("faiss", "synopsis.npy"),
+                os.path.join("faiss", "segments.npy"),
+                os.path.join("faiss", "segments.faiss"),
+                os.path.join("faiss", "segments_map.json")
+            ],
+            "model": os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2"),
+            "params": {}
+        },
+    }
+
+def catalog_artifacts(data_root):
+    # Mesmo critério do 03-dedup.py para escolher os vídeos deduplicados
+    video_dirs = sorted(os.path.dirname(os.path.dirname(p)) for p in glob.glob(os.path.join(data_root, "*", "faiss", "segments.npy")))
+    video_ids = [
+        os.path.basename(d) for d in video_dirs
+        if os.path.exists(os.path.join(d, "faiss", "synopsis.npy")) and os.path.exists(os.path.join(d, "transcription.json"))
+    ]
+    dedup_inputs = []
+    dedup_outputs = ["dedup.json"]
+    for video_id in video_ids:
+        for name in ["transcription.json", "info.json", os.path.join("faiss", "synopsis.npy"), os.path.join("faiss", "segments.npy")]:
+            if os.path.exists(os.path.join(data_root, video_id, name)):
+                dedup_inputs.append(os.path.join(video_id, name))
+        dedup_outputs.append(os.path.join(video_id, "faiss", "segments_duplicates.json"))
+    global_inputs = sorted(os.path.relpath(p, data_root) for p in glob.glob(os.path.join(data_root, "*", "faiss", "synopsis.npy")))
+    if os.path.exists(os.path.join(data_root, "dedup.json")):
+        global_inputs.append("dedup.json")
+    return {
+        "dedup": {
+            "script": "stage-2/03-dedup.py",
+            "inputs": dedup_inputs,
+            "outputs": dedup_outputs,
+            "model": None,
+            "params": {
+                "num_perm": int(os.environ.get("DEDUP_MINHASH_PERMUTATIONS", 128)),
+                "bands": int(os.environ.get("DEDUP_MINHASH_BANDS", 32)),
+                "video_shingle_size": int(os.environ.get("DEDUP_VIDEO_SHINGLE_SIZE", 5)),
+                "video_jaccard": float(os.environ.get("DEDUP_VIDEO_JACCARD", 0.7)),
+                "video_cosine": float(os.environ.get("DEDUP_VIDEO_COSINE", 0.95)),
+                "segment_shingle_size": int(os.environ.get("DEDUP_SEGMENT_SHINGLE_SIZE", 3)),
+                "segment_min_words": int(os.environ.get("DEDUP_SEGMENT_MIN_WORDS", 8)),
+                "segment_jaccard": float(os.environ.get("DEDUP_SEGMENT_JACCARD", 0.8)),
+                "segment_cosine": float(os.environ.get("DEDUP_SEGMENT_COSINE", 0.9)),
+            }
+        },
+        "global_index": {
+            "script": "stage-2/02-faiss-index-global.py",
+            "inputs": global_inputs,
+            "outputs": ["videos.faiss", "videos_map.json", "videos_shards.json"],
+            "model": None,
+            "params": {"shard_size": int(os.environ.get("SEARCH_INDEX_SHARD_SIZE", 50000))}
+        },
+    }
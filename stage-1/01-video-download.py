@@ -4,6 +4,9 @@ import os
 import yt_dlp
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import load_manifest, artifact_status, record_artifact, video_artifacts
+
 def log(action, data):
     print(json.dumps({"action": action, "data": data}), flush=True)
 
@@ -34,9 +37,16 @@ def main():
         log("error", {"code": 3, "msg": f"Erro ao obter info do vídeo: {str(e)}"})
         sys.exit(1)
     output_dir = os.path.join("..", "data", video_id)
+    spec = video_artifacts()["video"]
     if os.path.exists(output_dir):
-        log("error", {"code": 4, "msg": f"Pasta {output_dir} já existe", "video_id": video_id})
-        sys.exit(1)
+        status = artifact_status(load_manifest(output_dir), "video", output_dir, spec)
+        if status == "untracked":
+            record_artifact("video", output_dir, spec)
+            log("warning", {"msg": f"Vídeo já baixado em {output_dir} sem manifesto. Registrado com a configuração atual.", "video_id": video_id})
+        if status in ["current", "untracked"]:
+            log("info", {"msg": f"Vídeo em {output_dir} já está atualizado. Processo ignorado.", "video_id": video_id})
+            sys.exit(0)
+        log("info", {"msg": f"Vídeo em {output_dir} desatualizado ({status}). Baixando novamente.", "video_id": video_id})
     os.makedirs(output_dir, exist_ok=True)
     upload_date_str = info.get('upload_date')
     formatted_date = None
@@ -62,7 +72,8 @@ def main():
         log("error", {"code": 5, "msg": f"Não foi possível salvar o arquivo info.json: {str(e)}"})
         sys.exit(1)
     ydl_opts_download = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        'format': spec["params"]["format"],
+        'overwrites': True,
         'progress_hooks': [progress_hook],
         'outtmpl': os.path.join(output_dir, 'video.mp4'),
         'quiet': True,
@@ -72,6 +83,7 @@ def main():
     try:
         with yt_dlp.YoutubeDL(ydl_opts_download) as ydl:
             ydl.download([video_id])
+            record_artifact("video", output_dir, spec)
             log("done", {"video_id": video_id, "filename": os.path.join(output_dir, "video.mp4")})
     except Exception as e:
         log("error", {"code": 6, "msg": f"Erro no download: {str(e)}"})
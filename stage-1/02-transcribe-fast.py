@@ -5,6 +5,9 @@ import json
 import wave
 from faster_whisper import WhisperModel
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import load_manifest, artifact_status, record_artifact, video_artifacts
+
 def log(action, data):
     print(json.dumps({"action": action, "data": data}, ensure_ascii=False), flush=True)
 
@@ -27,16 +30,25 @@ def get_audio_duration(audio_path):
         return frames / float(rate)
 
 def main(video_id):
+    data_dir = f"../data/{video_id}"
     video_path = f"../data/{video_id}/video.mp4"
     audio_path = f"../data/{video_id}/audio.wav"
     output_path = f"../data/{video_id}/transcription.json"
     if not os.path.exists(video_path):
         log("error", f"Arquivo não encontrado: {video_path}")
         return
+    spec = video_artifacts("faster-whisper")["transcription"]
+    status = artifact_status(load_manifest(data_dir), "transcription", data_dir, spec)
+    if status == "untracked":
+        record_artifact("transcription", data_dir, spec)
+        log("warning", f"Transcrição em {output_path} sem manifesto. Registrada com a configuração atual.")
+    if status in ["current", "untracked"]:
+        log("status", f"Transcrição em {output_path} já está atualizada. Processo ignorado.")
+        return
     log("status", "Extraindo áudio...")
     extract_audio(video_path, audio_path)
     log("status", "Carregando modelo...")
-    model_size = os.environ.get("WHISPER_MODEL", "base")
+    model_size = spec["model"]
     model = WhisperModel(model_size, device="cuda", compute_type="float16")
     log("status", "Calculando duração do áudio...")
     total_duration = get_audio_duration(audio_path)
@@ -68,6 +80,7 @@ def main(video_id):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
+    record_artifact("transcription", data_dir, spec)
     log("done", {"msg": f"Transcrição salva em {output_path}"})
     if os.path.exists(audio_path):
         os.remove(audio_path)
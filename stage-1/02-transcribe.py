@@ -3,6 +3,9 @@ import os
 import json
 import whisper
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import load_manifest, artifact_status, record_artifact, video_artifacts
+
 def print_json(action, data):
     print(json.dumps({"action": action, "data": data}), flush=True)
 
@@ -12,17 +15,27 @@ def main():
             print_json("error", {"code": 1, "msg": "Parâmetro video_id não fornecido"})
             sys.exit(1)
         video_id = sys.argv[1]
-        video_path = os.path.join("..", "data", video_id, "video.mp4")
-        output_path = os.path.join("..", "data", video_id, "transcription.json")
+        data_dir = os.path.join("..", "data", video_id)
+        video_path = os.path.join(data_dir, "video.mp4")
+        output_path = os.path.join(data_dir, "transcription.json")
         if not os.path.isfile(video_path):
             print_json("error", {"code": 2, "msg": f"Arquivo não encontrado: {video_path}"})
             sys.exit(1)
-        model = whisper.load_model("base", device="cuda")
+        spec = video_artifacts("whisper")["transcription"]
+        status = artifact_status(load_manifest(data_dir), "transcription", data_dir, spec)
+        if status == "untracked":
+            record_artifact("transcription", data_dir, spec)
+            print_json("warning", {"msg": f"Transcrição em {output_path} sem manifesto. Registrada com a configuração atual."})
+        if status in ["current", "untracked"]:
+            print_json("info", {"msg": f"Transcrição em {output_path} já está atualizada. Processo ignorado."})
+            sys.exit(0)
+        model = whisper.load_model(spec["model"], device="cuda")
         print_json("progress", 0.0)
         result = model.transcribe(video_path, verbose=False)
         print_json("progress", 1.0)
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(result, f, ensure_ascii=False, indent=2)
+        record_artifact("transcription", data_dir, spec)
         print_json("done", {"msg": f"Transcrição salva em {output_path}"})
     except Exception as e:
         print_json("error", {"code": 99, "msg": str(e)})
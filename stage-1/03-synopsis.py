@@ -4,6 +4,9 @@ import os
 from llama_cpp import Llama
 from huggingface_hub import hf_hub_download
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import load_manifest, artifact_status, record_artifact, video_artifacts
+
 def log(action, data):
     try:
         payload = {"action": action, "data": data}
@@ -72,9 +75,16 @@ def main():
     data_dir = os.path.join("..", "data", video_id)
     input_file = os.path.join(data_dir, "transcription.json")
     output_file = os.path.join(data_dir, "synopsis.txt")
-    if os.path.isfile(output_file):
-        log("info", f"O arquivo de sinopse '{output_file}' já existe. Processo ignorado.")
-        sys.exit(0) 
+    spec = video_artifacts()["synopsis"]
+    status = artifact_status(load_manifest(data_dir), "synopsis", data_dir, spec)
+    if status == "untracked":
+        record_artifact("synopsis", data_dir, spec)
+        log("warning", f"O arquivo de sinopse '{output_file}' não tinha manifesto. Registrado com a configuração atual.")
+    if status in ["current", "untracked"]:
+        log("info", f"O arquivo de sinopse '{output_file}' já está atualizado. Processo ignorado.")
+        sys.exit(0)
+    if status != "missing":
+        log("info", f"O arquivo de sinopse '{output_file}' está desatualizado ({status}). Gerando novamente.")
     if not os.path.isfile(input_file):
         log("error", {"code": 2, "msg": f"Arquivo de entrada não encontrado: {input_file}"})
         sys.exit(1)
@@ -140,6 +150,7 @@ def main():
         try:
             with open(output_file, "w", encoding="utf-8") as f:
                 f.write(synopsis)
+            record_artifact("synopsis", data_dir, spec)
             log("info", f"Sinopse salva com sucesso em: {output_file}")
         except Exception as e:
             log("error", {"code": 7, "msg": f"Falha ao salvar o arquivo de sinopse: {str(e)}"})
@@ -6,6 +6,9 @@ import faiss
 from sentence_transformers import SentenceTransformer
 import math
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import load_manifest, artifact_status, record_artifact, video_artifacts
+
 def log(action, data):
     print(json.dumps({"action": action, "data": data}), flush=True)
 
@@ -23,22 +26,32 @@ def main():
     segments_npy_file = os.path.join(output_dir, "segments.npy")
     segments_faiss_file = os.path.join(output_dir, "segments.faiss")
     segments_map_file = os.path.join(output_dir, "segments_map.json")
-    output_files = [synopsis_npy_file, segments_npy_file, segments_faiss_file, segments_map_file]
-    if all(os.path.exists(f) for f in output_files):
-        log("info", "Todos os arquivos de índice já existem para este vídeo. Processo ignorado.")
+    spec = video_artifacts()["embeddings"]
+    status = artifact_status(load_manifest(base_dir), "embeddings", base_dir, spec)
+    if status == "untracked":
+        record_artifact("embeddings", base_dir, spec)
+        log("warning", "Arquivos de índice sem manifesto. Registrados com a configuração atual.")
+    if status in ["current", "untracked"]:
+        log("info", "Todos os arquivos de índice já estão atualizados para este vídeo. Processo ignorado.")
         sys.exit(0)
+    if status != "missing":
+        log("info", f"Arquivos de índice desatualizados ({status}). Gerando novamente.")
     if not os.path.exists(synopsis_file) or not os.path.exists(transcription_file):
         log("error", {"code": 3, "msg": f"Arquivos de entrada não encontrados em {base_dir}"})
         sys.exit(1)
     os.makedirs(output_dir, exist_ok=True)
     log("info", "Carregando o modelo de sentence-transformer...")
     try:
-        model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+        model_name = spec["model"]
         model = SentenceTransformer(model_name, device='cuda')
         log("success", {"msg": f"Modelo '{model_name}' carregado com sucesso."})
     except Exception as e:
         log("error", {"code": 2, "msg": f"Falha ao carregar o modelo: {str(e)}"})
         sys.exit(1)
+    # Remove as saídas anteriores para que uma sinopse ou transcrição vazia não deixe arquivos antigos registrados
+    for output_name in spec["outputs"]:
+        if os.path.exists(os.path.join(base_dir, output_name)):
+            os.remove(os.path.join(base_dir, output_name))
     try:
         log("info", "Processando a sinopse...")
         with open(synopsis_file, 'r', encoding='utf-8') as f:
@@ -58,6 +71,8 @@ def main():
             transcription_data = json.load(f)
         segments = transcription_data.get("segments", [])
         if not segments:
+            # Registra o artefato mesmo sem os arquivos de segmentos para que o plano não o agende de novo
+            record_artifact("embeddings", base_dir, spec)
             log("warning", "Nenhum segmento encontrado na transcrição. Finalizando.")
             sys.exit(0)
         texts = [seg['text'] for seg in segments]
@@ -92,6 +107,7 @@ def main():
         with open(segments_map_file, 'w', encoding='utf-8') as f:
             json.dump(segment_map, f, indent=2)
         log("success", {"msg": "Mapa dos segmentos salvo", "path": segments_map_file})
+        record_artifact("embeddings", base_dir, spec)
     except Exception as e:
         log("error", {"code": 5, "msg": f"Falha ao processar transcrição: {str(e)}"})
         sys.exit(1)
@@ -5,15 +5,47 @@ import numpy as np
 import faiss
 import glob
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import record_artifact, catalog_artifacts
+
 def log(action, data):
     print(json.dumps({"action": action, "data": data}), flush=True)
 
+def write_shards(embeddings_matrix, shards_dir, shards_file, shard_size):
+    os.makedirs(shards_dir, exist_ok=True)
+    for old_shard in glob.glob(os.path.join(shards_dir, "shard-*.faiss")):
+        os.remove(old_shard)
+    total = embeddings_matrix.shape[0]
+    d = embeddings_matrix.shape[1]
+    shards = []
+    for i, offset in enumerate(range(0, total, shard_size)):
+        shard_vectors = embeddings_matrix[offset:offset + shard_size]
+        shard_path = os.path.join(shards_dir, f"shard-{i:03d}.faiss")
+        # IVF com uma única lista: as listas invertidas são mapeadas com IO_FLAG_MMAP na busca (o IndexFlat
+        # seria copiado para cada processo) e, com uma lista só, a busca é exata e não há clustering a treinar
+        quantizer = faiss.IndexFlatL2(d)
+        quantizer.add(np.zeros((1, d), dtype='float32'))
+        shard_index = faiss.IndexIVFFlat(quantizer, d, 1)
+        shard_index.is_trained = True
+        shard_index.add(shard_vectors)
+        faiss.write_index(shard_index, shard_path)
+        shards.append({"file": os.path.basename(shard_path), "offset": offset, "ntotal": int(shard_index.ntotal)})
+    with open(shards_file, 'w', encoding='utf-8') as f:
+        json.dump({"dimension": d, "ntotal": total, "shards": shards}, f, indent=2)
+    return shards
+
 def main():
     log("start", {"script": "02-faiss-index-global"})
     data_root = os.path.join("..", "data")
     output_dir = os.path.join(data_root)
     global_faiss_file = os.path.join(output_dir, "videos.faiss")
     global_map_file = os.path.join(output_dir, "videos_map.json")
+    global_clusters_file = os.path.join(output_dir, "videos_clusters.json")
+    dedup_file = os.path.join(data_root, "dedup.json")
+    shards_dir = os.path.join(output_dir, "videos_shards")
+    shards_file = os.path.join(output_dir, "videos_shards.json")
+    spec = catalog_artifacts(data_root)["global_index"]
+    shard_size = spec["params"]["shard_size"]
     os.makedirs(output_dir, exist_ok=True)
     log("info", "Iniciando busca por arquivos de sinopse processados...")
     search_pattern = os.path.join(data_root, "*", "faiss", "synopsis.npy")
@@ -22,12 +54,25 @@ def main():
         log("warning", "Nenhum arquivo 'synopsis.npy' encontrado. Nenhum índice foi gerado.")
         sys.exit(0)
     log("info", f"Encontrados {len(embedding_files)} vídeos para indexar.")
+    canonical_of = {}
+    video_clusters = {}
+    if os.path.exists(dedup_file):
+        try:
+            with open(dedup_file, 'r', encoding='utf-8') as f:
+                dedup_data = json.load(f)
+            canonical_of = dedup_data.get("canonical_of", {})
+            video_clusters = dedup_data.get("videos", {})
+            log("info", f"Mapa de duplicatas carregado: {len(canonical_of)} vídeos serão representados pelo seu canônico.")
+        except Exception as e:
+            log("warning", {"msg": "Falha ao ler o mapa de duplicatas. Indexando todos os vídeos.", "error": str(e)})
     all_embeddings = []
     video_ids_map = []
     for file_path in embedding_files:
         try:
             embedding = np.load(file_path)
             video_id = os.path.basename(os.path.dirname(os.path.dirname(file_path)))
+            if canonical_of.get(video_id, video_id) != video_id:
+                continue
             all_embeddings.append(embedding)
             video_ids_map.append(video_id)
         except Exception as e:
@@ -44,10 +89,22 @@ def main():
         index.add(embeddings_matrix)
         faiss.write_index(index, global_faiss_file)
         log("success", {"msg": "Índice FAISS global salvo", "path": global_faiss_file})
+        shards = write_shards(embeddings_matrix, shards_dir, shards_file, shard_size)
+        log("success", {"msg": f"Índice global dividido em {len(shards)} shards", "path": shards_file})
         final_map = {i: vid for i, vid in enumerate(video_ids_map)}
         with open(global_map_file, 'w', encoding='utf-8') as f:
             json.dump(final_map, f, indent=2)
         log("success", {"msg": "Mapa de vídeos global salvo", "path": global_map_file})
+        with open(global_clusters_file, 'w', encoding='utf-8') as f:
+            json.dump({canonical: members for canonical, members in video_clusters.items() if canonical in video_ids_map}, f, indent=2)
+        log("success", {"msg": "Clusters de vídeos duplicados salvos", "path": global_clusters_file})
+        record_artifact("global_index", data_root, spec)
+        if canonical_of:
+            log("report", {
+                "videos_found": len(embedding_files),
+                "videos_indexed": len(video_ids_map),
+                "reduction": round(1 - len(video_ids_map) / len(embedding_files), 4)
+            })
     except Exception as e:
         log("error", {"msg": "Falha ao construir ou salvar o índice FAISS global", "error": str(e)})
         sys.exit(1)
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import glob
+import re
+import zlib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stage-0"))
+from manifest import record_artifact, catalog_artifacts
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+def log(action, data):
+    print(json.dumps({"action": action, "data": data}), flush=True)
+
+def shingles(text, size):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(shingle_set, perm_a, perm_b):
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingle_set], dtype=np.uint64) % MERSENNE_PRIME
+    return ((np.outer(hashes, perm_a) + perm_b) % MERSENNE_PRIME).min(axis=0)
+
+def lsh_candidates(signatures, bands):
+    rows = len(next(iter(signatures.values()))) // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for key, signature in signatures.items():
+            bucket = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(bucket, []).append(key)
+        for members in buckets.values():
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add((members[i], members[j]))
+    return pairs
+
+def cosine(a, b):
+    return float(np.dot(a, b) / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+
+def find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+def cluster(keys, pairs, order_key):
+    parent = {k: k for k in keys}
+    for a, b in pairs:
+        root_a, root_b = find(parent, a), find(parent, b)
+        if root_a != root_b:
+            parent[max(root_a, root_b, key=order_key)] = min(root_a, root_b, key=order_key)
+    clusters = {}
+    for k in keys:
+        clusters.setdefault(find(parent, k), []).append(k)
+    return {root: sorted(members, key=order_key) for root, members in clusters.items() if len(members) > 1}
+
+def main():
+    log("start", {"script": "03-dedup"})
+    data_root = os.path.join("..", "data")
+    dedup_file = os.path.join(data_root, "dedup.json")
+    config = catalog_artifacts(data_root)["dedup"]["params"]
+    rng = np.random.default_rng(1)
+    perm_a = rng.integers(1, MERSENNE_PRIME, size=config["num_perm"], dtype=np.uint64)
+    perm_b = rng.integers(0, MERSENNE_PRIME, size=config["num_perm"], dtype=np.uint64)
+
+    log("info", "Carregando transcrições e embeddings do catálogo...")
+    videos = {}
+    for segments_npy_file in sorted(glob.glob(os.path.join(data_root, "*", "faiss", "segments.npy"))):
+        video_dir = os.path.dirname(os.path.dirname(segments_npy_file))
+        video_id = os.path.basename(video_dir)
+        synopsis_npy_file = os.path.join(video_dir, "faiss", "synopsis.npy")
+        transcription_file = os.path.join(video_dir, "transcription.json")
+        info_file = os.path.join(video_dir, "info.json")
+        if not os.path.exists(synopsis_npy_file) or not os.path.exists(transcription_file):
+            log("warning", f"Arquivos essenciais para o vídeo {video_id} não encontrados. Pulando.")
+            continue
+        try:
+            with open(transcription_file, 'r', encoding='utf-8') as f:
+                segments = json.load(f).get("segments", [])
+            info_data = {}
+            if os.path.exists(info_file):
+                with open(info_file, 'r', encoding='utf-8') as f:
+                    info_data = json.load(f)
+            videos[video_id] = {
+                "segments": segments,
+                "segment_embeddings": np.load(segments_npy_file),
+                "synopsis_embedding": np.load(synopsis_npy_file),
+                "upload_date": info_data.get("data_upload") or "9999-99-99",
+            }
+        except Exception as e:
+            log("error", {"msg": f"Falha ao carregar dados do vídeo {video_id}", "error": str(e)})
+    if not videos:
+        log("warning", "Nenhum vídeo processado encontrado. Nada a deduplicar.")
+        sys.exit(0)
+    # O vídeo canônico de um cluster é o mais antigo (o original, não o re-upload)
+    video_order = lambda vid: (videos[vid]["upload_date"], vid)
+
+    log("info", f"Calculando MinHash das transcrições de {len(videos)} vídeos...")
+    video_signatures = {}
+    for video_id, video in videos.items():
+        text = " ".join(seg.get("text", "") for seg in video["segments"])
+        shingle_set = shingles(text, config["video_shingle_size"])
+        if shingle_set:
+            video_signatures[video_id] = minhash(shingle_set, perm_a, perm_b)
+    video_pairs = []
+    for a, b in lsh_candidates(video_signatures, config["bands"]) if video_signatures else []:
+        jaccard = float(np.mean(video_signatures[a] == video_signatures[b]))
+        if jaccard < config["video_jaccard"]:
+            continue
+        if cosine(videos[a]["synopsis_embedding"], videos[b]["synopsis_embedding"]) >= config["video_cosine"]:
+            video_pairs.append((a, b))
+    video_clusters = cluster(list(videos), video_pairs, video_order)
+    canonical_of = {vid: vid for vid in videos}
+    for canonical, members in video_clusters.items():
+        for member in members:
+            canonical_of[member] = canonical
+    log("success", {"msg": f"{len(video_clusters)} clusters de vídeos duplicados encontrados."})
+
+    log("info", "Calculando MinHash dos segmentos...")
+    segment_signatures = {}
+    for video_id, video in videos.items():
+        for row, seg in enumerate(video["segments"][:len(video["segment_embeddings"])]):
+            text = seg.get("text", "")
+            if len(text.split()) < config["segment_min_words"]:
+                continue
+            shingle_set = shingles(text, config["segment_shingle_size"])
+            if shingle_set:
+                segment_signatures[(video_id, row)] = minhash(shingle_set, perm_a, perm_b)
+    segment_pairs = []
+    for a, b in lsh_candidates(segment_signatures, config["bands"]) if segment_signatures else []:
+        # Cópias de um mesmo vídeo já são tratadas no nível de vídeo; seus índices de segmentos ficam intactos
+        if a[0] != b[0] and canonical_of[a[0]] == canonical_of[b[0]]:
+            continue
+        jaccard = float(np.mean(segment_signatures[a] == segment_signatures[b]))
+        if jaccard < config["segment_jaccard"]:
+            continue
+        emb_a = videos[a[0]]["segment_embeddings"][a[1]]
+        emb_b = videos[b[0]]["segment_embeddings"][b[1]]
+        if cosine(emb_a, emb_b) >= config["segment_cosine"]:
+            segment_pairs.append((a, b))
+    segment_order = lambda key: (video_order(key[0]), videos[key[0]]["segments"][key[1]].get("start", 0), key[1])
+    segment_clusters = cluster(list(segment_signatures), segment_pairs, segment_order)
+    log("success", {"msg": f"{len(segment_clusters)} clusters de segmentos repetidos encontrados."})
+
+    log("info", "Salvando o mapa de segmentos repetidos de cada vídeo...")
+    duplicates_by_video = {vid: {} for vid in videos}
+    for (canonical_vid, canonical_row), members in segment_clusters.items():
+        canonical_seg_id = videos[canonical_vid]["segments"][canonical_row]["id"]
+        for member_vid, member_row in members[1:]:
+            # Pares já são filtrados acima, mas a união transitiva (A-B, A'-B) ainda junta cópias no mesmo cluster
+            if member_vid != canonical_vid and canonical_of[member_vid] == canonical_of[canonical_vid]:
+                continue
+            member_seg_id = videos[member_vid]["segments"][member_row]["id"]
+            duplicates_by_video[member_vid][member_seg_id] = {"video_id": canonical_vid, "segment_id": canonical_seg_id}
+    segments_total = 0
+    segments_repeated = 0
+    for video_id, video in videos.items():
+        output_dir = os.path.join(data_root, video_id, "faiss")
+        duplicates = duplicates_by_video[video_id]
+        try:
+            # O QA lê este mapa e só descarta o trecho quando o vídeo canônico também está no contexto
+            with open(os.path.join(output_dir, "segments_duplicates.json"), 'w', encoding='utf-8') as f:
+                json.dump(duplicates, f, indent=2)
+            # Índices deduplicados gerados por versões anteriores deste script, que nenhuma busca lia
+            for stale_file in ["segments_dedup.faiss", "segments_dedup_map.json"]:
+                if os.path.exists(os.path.join(output_dir, stale_file)):
+                    os.remove(os.path.join(output_dir, stale_file))
+        except Exception as e:
+            log("error", {"msg": f"Falha ao salvar as duplicatas de segmentos do vídeo {video_id}", "error": str(e)})
+            sys.exit(1)
+        segments_total += len(video["segment_embeddings"])
+        segments_repeated += len(duplicates)
+
+    videos_before = len(videos)
+    videos_after = len(set(canonical_of.values()))
+    dimension = len(next(iter(videos.values()))["synopsis_embedding"])
+    report = {
+        "videos_before": videos_before,
+        "videos_after": videos_after,
+        "videos_index_bytes_before": videos_before * dimension * 4,
+        "videos_index_bytes_after": videos_after * dimension * 4,
+        "videos_reduction": round(1 - videos_after / videos_before, 4),
+        "segments_total": segments_total,
+        "segments_repeated": segments_repeated,
+    }
+    dedup_data = {
+        "config": config,
+        "report": report,
+        "videos": {canonical: members for canonical, members in video_clusters.items()},
+        "canonical_of": {vid: canonical for vid, canonical in canonical_of.items() if vid != canonical},
+    }
+    try:
+        with open(dedup_file, 'w', encoding='utf-8') as f:
+            json.dump(dedup_data, f, ensure_ascii=False, indent=2)
+        log("success", {"msg": "Mapa de duplicatas salvo", "path": dedup_file})
+        record_artifact("dedup", data_root, catalog_artifacts(data_root)["dedup"])
+    except Exception as e:
+        log("error", {"msg": "Falha ao salvar o mapa de duplicatas", "error": str(e)})
+        sys.exit(1)
+    log("report", report)
+    log("done", "Deduplicação concluída. Execute 02-faiss-index-global.py para reconstruir o índice global.")
+
+if __name__ == "__main__":
+    main()
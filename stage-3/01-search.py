@@ -3,12 +3,145 @@ import os
 import json
 import numpy as np
 import faiss
+import multiprocessing
+import time
 from sentence_transformers import SentenceTransformer
 
+# Shards abertos em cada processo do pool (via mmap, compartilhando o page cache)
+worker_shards = []
+worker_error = None
+
 def log(action, data):
     print(json.dumps({"action": action, "data": data}), flush=True)
 
-def perform_search(query_text, model, index, video_map, k, data_root):
+def open_shard(shards_dir, shard):
+    shard_path = os.path.join(shards_dir, shard["file"])
+    index = faiss.read_index(shard_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        raise ValueError(f"Shard {shard_path} não é um índice IVF. Execute o script da stage-2 novamente.")
+    # Percorre todas as listas: o resultado é exato, igual ao do IndexFlatL2
+    ivf.nprobe = ivf.nlist
+    return index
+
+def process_memory(_=None):
+    memory = {"pid": os.getpid()}
+    with open("/proc/self/status", 'r') as f:
+        for line in f:
+            if line.startswith(("RssAnon", "RssFile")):
+                name, value = line.split(":")
+                memory[name] = round(int(value.split()[0]) / 1024, 1)
+    time.sleep(0.05)
+    return memory
+
+def init_shard_worker(shards_dir, shards):
+    global worker_shards, worker_error
+    faiss.omp_set_num_threads(1)
+    worker_shards = []
+    try:
+        for shard in shards:
+            worker_shards.append((open_shard(shards_dir, shard), shard["offset"]))
+    except Exception as e:
+        # Um erro aqui faria o Pool recriar o processo indefinidamente; é reportado na busca
+        worker_error = str(e)
+
+def search_shard(args):
+    if worker_error:
+        raise RuntimeError(f"Falha ao abrir os shards no processo {os.getpid()}: {worker_error}")
+    shard_id, query_embedding, k = args
+    index, offset = worker_shards[shard_id]
+    distances, indices = index.search(query_embedding, min(k, index.ntotal))
+    indices = np.where(indices == -1, -1, indices + offset)
+    return distances, indices
+
+class ShardedIndex:
+    def __init__(self, shards_dir, shards, dimension, workers):
+        # Valida os shards antes do fork para que erros cheguem ao processo principal
+        for shard in shards:
+            open_shard(shards_dir, shard)
+        self.d = dimension
+        self.workers = workers
+        self.num_shards = len(shards)
+        self.ntotal = sum(shard["ntotal"] for shard in shards)
+        self.pool = multiprocessing.get_context("fork").Pool(
+            processes=workers,
+            initializer=init_shard_worker,
+            initargs=(shards_dir, shards)
+        )
+
+    def search(self, query_embeddings, k):
+        # Divide as consultas em lotes para que cada par (lote, shard) seja uma tarefa: consultas
+        # simultâneas ocupam todos os processos do pool, não apenas um por shard
+        num_batches = max(1, min(len(query_embeddings), -(-2 * self.workers // self.num_shards)))
+        batches = np.array_split(query_embeddings, num_batches)
+        tasks = [(shard_id, batch, k) for batch in batches for shard_id in range(self.num_shards)]
+        partials = self.pool.map(search_shard, tasks, chunksize=1)
+        all_distances = []
+        all_indices = []
+        for b in range(num_batches):
+            batch_partials = partials[b * self.num_shards:(b + 1) * self.num_shards]
+            distances = np.hstack([p[0] for p in batch_partials])
+            indices = np.hstack([p[1] for p in batch_partials])
+            distances = np.where(indices == -1, np.inf, distances)
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            all_distances.append(np.take_along_axis(distances, order, axis=1))
+            all_indices.append(np.take_along_axis(indices, order, axis=1))
+        return np.vstack(all_distances), np.vstack(all_indices)
+
+    def worker_memory(self):
+        samples = self.pool.map(process_memory, range(self.workers * 4), chunksize=1)
+        return list({sample["pid"]: sample for sample in samples}.values())
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+def load_index(data_root, faiss_file):
+    shards_file = os.path.join(data_root, "videos_shards.json")
+    if not os.path.exists(shards_file):
+        return faiss.read_index(faiss_file)
+    with open(shards_file, 'r', encoding='utf-8') as f:
+        shards_data = json.load(f)
+    shards = shards_data["shards"]
+    workers = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))
+    log("info", f"Abrindo {len(shards)} shards com mmap em {workers} processos...")
+    return ShardedIndex(os.path.join(data_root, "videos_shards"), shards, shards_data["dimension"], workers)
+
+def run_benchmark(index, num_queries, batch_size, k):
+    queries = np.random.default_rng(0).random((num_queries, index.d), dtype='float32')
+    start = time.perf_counter()
+    for i in range(0, num_queries, batch_size):
+        index.search(queries[i:i + batch_size], k)
+    elapsed = time.perf_counter() - start
+    workers = index.worker_memory() if isinstance(index, ShardedIndex) else [process_memory()]
+    log("result", {
+        "queries": num_queries,
+        "batch_size": batch_size,
+        "k": k,
+        "workers": len(workers),
+        "qps": round(num_queries / elapsed, 1),
+        "parent_memory_mb": process_memory(),
+        "worker_memory_mb": workers
+    })
+
+def load_video_info(data_root, video_id):
+    # --- LÓGICA DE ENRIQUECIMENTO ---
+    title = "Título não encontrado"
+    thumbnail_url = None
+    try:
+        info_path = os.path.join(data_root, video_id, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info_data = json.load(f)
+                title = info_data.get('titulo', title)
+                thumbnail_url = info_data.get('url_thumbnail')
+    except Exception:
+        # Se houver erro ao ler o info.json, não quebra a busca
+        pass
+    return title, thumbnail_url
+
+def perform_search(query_text, model, index, video_map, video_clusters, k, data_root):
     try:
         log("info", {"query": query_text})
         query_embedding = model.encode(query_text, convert_to_numpy=True).astype('float32')
@@ -25,24 +158,19 @@ def perform_search(query_text, model, index, video_map, k, data_root):
 
             video_id = video_map.get(str(idx))
             if video_id:
-                # --- LÓGICA DE ENRIQUECIMENTO ---
-                title = "Título não encontrado"
-                thumbnail_url = None
-                try:
-                    info_path = os.path.join(data_root, video_id, "info.json")
-                    if os.path.exists(info_path):
-                        with open(info_path, 'r', encoding='utf-8') as f:
-                            info_data = json.load(f)
-                            title = info_data.get('titulo', title)
-                            thumbnail_url = info_data.get('url_thumbnail')
-                except Exception:
-                    # Se houver erro ao ler o info.json, não quebra a busca
-                    pass 
+                title, thumbnail_url = load_video_info(data_root, video_id)
+                # Expande o vídeo canônico para as demais cópias do seu cluster
+                duplicates = []
+                for member_id in video_clusters.get(video_id, []):
+                    if member_id != video_id:
+                        member_title, _ = load_video_info(data_root, member_id)
+                        duplicates.append({"video_id": member_id, "title": member_title})
                 results.append({
                     "video_id": video_id,
                     "title": title,
                     "thumbnail_url": thumbnail_url,
-                    "distance": float(dist)
+                    "distance": float(dist),
+                    "duplicates": duplicates
                 })
         log("result", results)
     except Exception as e:
@@ -52,17 +180,35 @@ def main():
     data_root = os.path.join("..", "data")
     faiss_file = os.path.join(data_root, "videos.faiss")
     map_file = os.path.join(data_root, "videos_map.json")
+    clusters_file = os.path.join(data_root, "videos_clusters.json")
     if not os.path.exists(faiss_file) or not os.path.exists(map_file):
         log("error", {"code": 2, "msg": f"Arquivos de índice global não encontrados em '{data_root}'. Execute o script da stage-2 primeiro."})
         sys.exit(1)
+    try:
+        # O pool de shards é criado antes do modelo para que o fork não herde o contexto CUDA
+        log("info", "Carregando índice FAISS e mapa de vídeos...")
+        index = load_index(data_root, faiss_file)
+    except Exception as e:
+        log("error", {"code": 3, "msg": f"Falha ao carregar os índices: {str(e)}"})
+        sys.exit(1)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+        log("start", {"mode": "benchmark", "queries": num_queries, "batch_size": batch_size, "k": 5})
+        run_benchmark(index, num_queries, batch_size, 5)
+        if isinstance(index, ShardedIndex):
+            index.close()
+        sys.exit(0)
     try:
         log("info", "Carregando modelo de IA (isso pode levar um momento)...")
-        model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+        model_name = os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
         model = SentenceTransformer(model_name, device='cuda')
-        log("info", "Carregando índice FAISS e mapa de vídeos...")
-        index = faiss.read_index(faiss_file)
         with open(map_file, 'r', encoding='utf-8') as f:
             video_map = json.load(f)
+        video_clusters = {}
+        if os.path.exists(clusters_file):
+            with open(clusters_file, 'r', encoding='utf-8') as f:
+                video_clusters = json.load(f)
         log("success", "Sistema de busca pronto.")
     except Exception as e:
         log("error", {"code": 3, "msg": f"Falha ao carregar modelo ou índices: {str(e)}"})
@@ -71,7 +217,7 @@ def main():
         query_text = sys.argv[1]
         k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
         log("start", {"mode": "single_run", "query": query_text, "k": k})
-        perform_search(query_text, model, index, video_map, k, data_root)
+        perform_search(query_text, model, index, video_map, video_clusters, k, data_root)
     else:
         k = 5
         log("start", {"mode": "interactive", "k": k})
@@ -84,11 +230,13 @@ def main():
                     break
                 if not query_text.strip():
                     continue
-                perform_search(query_text, model, index, video_map, k, data_root)
+                perform_search(query_text, model, index, video_map, video_clusters, k, data_root)
             except (KeyboardInterrupt, EOFError):
                 break
         
         log("done", "Sessão interativa encerrada.")
+    if isinstance(index, ShardedIndex):
+        index.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
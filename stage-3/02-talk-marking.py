@@ -5,6 +5,7 @@ import os
 import json
 import numpy as np
 import faiss
+from collections import OrderedDict
 from sentence_transformers import SentenceTransformer
 from llama_cpp import Llama
 from huggingface_hub import hf_hub_download
@@ -44,6 +45,129 @@ def generate_answer(llm, query, citations):
         log("error", {"msg": "Falha na geração de resposta do LLM", "error": str(e)})
         return "Ocorreu um erro ao tentar gerar a resposta."
 
+def load_video_segments(data_root, video_id, context_video_ids=()):
+    video_dir = os.path.join(data_root, video_id)
+    segments_npy_file = os.path.join(video_dir, "faiss", "segments.npy")
+    duplicates_file = os.path.join(video_dir, "faiss", "segments_duplicates.json")
+    transcription_file = os.path.join(video_dir, "transcription.json")
+    info_file = os.path.join(video_dir, "info.json")
+    if not all(os.path.exists(f) for f in [segments_npy_file, transcription_file, info_file]):
+        log("warning", f"Arquivos essenciais para o vídeo {video_id} não encontrados. Pulando.")
+        return None
+    try:
+        embeddings = np.load(segments_npy_file)
+        with open(transcription_file, 'r', encoding='utf-8') as f: transcription_data = json.load(f)
+        with open(info_file, 'r', encoding='utf-8') as f: info_data = json.load(f)
+        duplicates = {}
+        if os.path.exists(duplicates_file):
+            with open(duplicates_file, 'r', encoding='utf-8') as f: duplicates = json.load(f)
+        author = info_data.get("autor", "Autor desconhecido")
+        segments = transcription_data.get("segments", [])[:len(embeddings)]
+        rows = []
+        metadata = []
+        for row, segment in enumerate(segments):
+            duplicate_of = duplicates.get(str(segment['id']))
+            # Só descarta o trecho repetido se o vídeo com a cópia canônica também estiver no contexto
+            if duplicate_of and duplicate_of["video_id"] in context_video_ids:
+                continue
+            rows.append(row)
+            citation = {
+                "video_id": video_id,
+                "segment_id": segment['id'],
+                "author": author,
+                "timestamp": format_timestamp(segment.get("start", 0)),
+                "text": segment.get("text", "").strip()
+            }
+            if duplicate_of:
+                citation["duplicate_of"] = duplicate_of
+            metadata.append(citation)
+        video_embeddings = embeddings[rows].astype('float32')
+        faiss.normalize_L2(video_embeddings)
+        return video_embeddings, metadata
+    except Exception as e:
+        log("error", {"msg": f"Falha ao carregar dados do vídeo {video_id}", "error": str(e)})
+        return None
+
+def unique_citations(citations, k):
+    # Cópias de um mesmo trecho (segments_duplicates.json) contam uma só vez, com a maior similaridade
+    citations = sorted(citations, key=lambda x: x['similarity_score'], reverse=True)
+    seen = set()
+    unique = []
+    for citation in citations:
+        canonical = citation.get("duplicate_of", citation)
+        key = (canonical["video_id"], canonical["segment_id"])
+        if key not in seen:
+            seen.add(key)
+            unique.append(citation)
+    return unique[:k]
+
+def search_segments(index, metadata, query_embedding, k):
+    if index.ntotal == 0:
+        return []
+    similarities, indices = index.search(query_embedding, min(k, index.ntotal))
+    citations = []
+    for i in range(len(indices[0])):
+        idx = indices[0][i]
+        if idx != -1:
+            citation_data = metadata[idx].copy()
+            citation_data['similarity_score'] = float(similarities[0][i])
+            citations.append(citation_data)
+    return citations
+
+class SegmentIndexCache:
+    # LRU de índices de segmentos por vídeo, compartilhado entre as perguntas da sessão
+    def __init__(self, data_root, capacity):
+        self.data_root = data_root
+        self.capacity = max(1, capacity)
+        self.entries = OrderedDict()
+
+    def get(self, video_id):
+        if video_id in self.entries:
+            self.entries.move_to_end(video_id)
+            return self.entries[video_id]
+        entry = None
+        loaded = load_video_segments(self.data_root, video_id)
+        if loaded and len(loaded[1]) > 0:
+            index = faiss.IndexFlatIP(loaded[0].shape[1])
+            index.add(loaded[0])
+            entry = (index, loaded[1])
+        self.entries[video_id] = entry
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry
+
+def build_synopsis_index(data_root, video_ids):
+    embeddings = []
+    ranked_video_ids = []
+    unranked_video_ids = []
+    for video_id in video_ids:
+        synopsis_npy_file = os.path.join(data_root, video_id, "faiss", "synopsis.npy")
+        if not os.path.exists(synopsis_npy_file):
+            log("warning", f"Sinopse do vídeo {video_id} não encontrada. Seus trechos serão buscados em todas as perguntas.")
+            unranked_video_ids.append(video_id)
+            continue
+        embeddings.append(np.load(synopsis_npy_file).reshape(1, -1))
+        ranked_video_ids.append(video_id)
+    if not embeddings:
+        return None, ranked_video_ids, unranked_video_ids
+    synopsis_embeddings = np.vstack(embeddings).astype('float32')
+    faiss.normalize_L2(synopsis_embeddings)
+    index = faiss.IndexFlatIP(synopsis_embeddings.shape[1])
+    index.add(synopsis_embeddings)
+    return index, ranked_video_ids, unranked_video_ids
+
+def retrieve_two_stage(query_embedding, synopsis_index, ranked_video_ids, unranked_video_ids, segment_cache, top_videos, k):
+    video_ids = list(unranked_video_ids)
+    if synopsis_index is not None:
+        _, video_indices = synopsis_index.search(query_embedding, min(top_videos, synopsis_index.ntotal))
+        video_ids += [ranked_video_ids[idx] for idx in video_indices[0] if idx != -1]
+    citations = []
+    for video_id in video_ids:
+        entry = segment_cache.get(video_id)
+        if entry:
+            citations.extend(search_segments(entry[0], entry[1], query_embedding, k))
+    return unique_citations(citations, k)
+
 def main():
     if len(sys.argv) < 2:
         log("error", {"code": 1, "msg": "Uso: python 02-talk-marking.py <video_id_1> ..."})
@@ -54,7 +178,7 @@ def main():
 
     log("info", "Iniciando assistente de QA. Carregando todos os modelos...")
     try:
-        retriever_model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+        retriever_model_name = os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
         retriever_model = SentenceTransformer(retriever_model_name, device='cuda')
 
         llm_repo_id = os.environ.get("LLM_HUGGINGFACE_REPO_ID")
@@ -72,50 +196,42 @@ def main():
         log("error", {"code": 2, "msg": f"Falha crítica ao carregar modelos: {str(e)}"})
         sys.exit(1)
 
-    log("info", "Construindo contexto de busca a partir dos vídeos fornecidos...")
-    all_embeddings = []
-    master_map = []
     data_root = os.path.join("..", "data")
-    for video_id in video_ids_context:
-        video_dir = os.path.join(data_root, video_id)
-        segments_npy_file = os.path.join(video_dir, "faiss", "segments.npy")
-        transcription_file = os.path.join(video_dir, "transcription.json")
-        info_file = os.path.join(video_dir, "info.json")
-        if not all(os.path.exists(f) for f in [segments_npy_file, transcription_file, info_file]):
-            log("warning", f"Arquivos essenciais para o vídeo {video_id} não encontrados. Pulando.")
-            continue
+    top_videos = int(os.environ.get("QA_COARSE_TOP_VIDEOS", 5))
+    cache_size = int(os.environ.get("QA_SEGMENT_CACHE_SIZE", 16))
+    k = 3
+    similarity_threshold = 0.5
+
+    if top_videos > 0 and len(video_ids_context) > top_videos:
+        log("info", f"Contexto grande: usando busca em dois estágios (top {top_videos} vídeos por pergunta)...")
         try:
-            embeddings = np.load(segments_npy_file)
-            with open(transcription_file, 'r', encoding='utf-8') as f: transcription_data = json.load(f)
-            with open(info_file, 'r', encoding='utf-8') as f: info_data = json.load(f)
-            all_embeddings.append(embeddings)
-            author = info_data.get("autor", "Autor desconhecido")
-            segments_metadata = {seg['id']: seg for seg in transcription_data.get("segments", [])}
-            for i in range(len(embeddings)):
-                segment = segments_metadata.get(i)
-                if segment:
-                    master_map.append({
-                        "video_id": video_id,
-                        "author": author,
-                        "timestamp": format_timestamp(segment.get("start", 0)),
-                        "text": segment.get("text", "").strip()
-                    })
+            synopsis_index, ranked_video_ids, unranked_video_ids = build_synopsis_index(data_root, video_ids_context)
         except Exception as e:
-            log("error", {"msg": f"Falha ao carregar dados do vídeo {video_id}", "error": str(e)})
+            log("error", {"code": 4, "msg": f"Falha ao carregar as sinopses do contexto: {str(e)}"})
+            sys.exit(1)
+        segment_cache = SegmentIndexCache(data_root, cache_size)
+        retrieve = lambda query_embedding: retrieve_two_stage(query_embedding, synopsis_index, ranked_video_ids, unranked_video_ids, segment_cache, top_videos, k)
+        log("success", f"Assistente pronto. Contexto com {len(ranked_video_ids) + len(unranked_video_ids)} vídeos carregado.")
+    else:
+        log("info", "Construindo contexto de busca a partir dos vídeos fornecidos...")
+        all_embeddings = []
+        master_map = []
+        for video_id in video_ids_context:
+            loaded = load_video_segments(data_root, video_id, video_ids_context)
+            if loaded:
+                all_embeddings.append(loaded[0])
+                master_map.extend(loaded[1])
 
+        if not all_embeddings:
+            log("error", {"code": 4, "msg": "Nenhum vídeo válido carregado."})
+            sys.exit(1)
 
-    if not all_embeddings:
-        log("error", {"code": 4, "msg": "Nenhum vídeo válido carregado."})
-        sys.exit(1)
+        combined_embeddings = np.vstack(all_embeddings)
+        index = faiss.IndexFlatIP(combined_embeddings.shape[1])
+        index.add(combined_embeddings)
+        retrieve = lambda query_embedding: search_segments(index, master_map, query_embedding, k)
+        log("success", f"Assistente pronto. Contexto com {index.ntotal} trechos carregado.")
 
-    combined_embeddings = np.vstack(all_embeddings).astype('float32')
-    faiss.normalize_L2(combined_embeddings)
-    index = faiss.IndexFlatIP(combined_embeddings.shape[1])
-    index.add(combined_embeddings)
-    log("success", f"Assistente pronto. Contexto com {index.ntotal} trechos carregado.")
-
-    k = 3
-    similarity_threshold = 0.5
     print("\nFaça sua pergunta sobre os vídeos carregados.")
     print("Digite 'exit' ou 'quit' para sair.")
     
@@ -128,16 +244,7 @@ def main():
             query_embedding = retriever_model.encode(query_text, convert_to_numpy=True).astype('float32')
             query_embedding = np.expand_dims(query_embedding, axis=0)
             faiss.normalize_L2(query_embedding)
-            similarities, indices = index.search(query_embedding, k)
-            
-            citations = []
-            for i in range(len(indices[0])):
-                idx = indices[0][i]
-                sim = similarities[0][i]
-                if idx != -1 and sim >= similarity_threshold:
-                    citation_data = master_map[idx].copy()
-                    citation_data['similarity_score'] = float(sim)
-                    citations.append(citation_data)
+            citations = [c for c in retrieve(query_embedding) if c['similarity_score'] >= similarity_threshold]
             
             generated_message = generate_answer(llm, query_text, citations)
             log("message", generated_message)